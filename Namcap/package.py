@@ -279,6 +279,44 @@ def load_testing_package(pkgname):
             return load_from_alpm(p)
 
 
+def load_many_from_db(pkgnames, dbname=None):
+    "Like load_from_db() for several packages, looking up providers in one pass. Returns { name => package or None }"
+    if dbname is None:
+        db = pyalpm_handle.get_localdb()
+    else:
+        db = pyalpm_handle.register_syncdb(dbname, 0)
+    found = {name: db.get_pkg(name) for name in pkgnames}
+
+    missing = {name for name, p in found.items() if p is None}
+    if missing:
+        for pkg in db.pkgcache:
+            for provide in pkg.provides:
+                name = strip_depend_info(provide)
+                if name in missing:
+                    found[name] = pkg
+                    missing.discard(name)
+            if not missing:
+                break
+
+    return {name: None if p is None else load_from_alpm(p) for name, p in found.items()}
+
+
+def load_many_testing(pkgnames):
+    "Like load_testing_package() for several packages. Returns { name => package or None }"
+    testing_dbs = [
+        db for db in pyalpm_handle.get_syncdbs() if db.name in ("testing", "multilib-testing", "community-testing")
+    ]
+    found: dict[str, PacmanPackage | None] = {}
+    for name in pkgnames:
+        found[name] = None
+        for db in testing_dbs:
+            p = db.get_pkg(name)
+            if p is not None:
+                found[name] = load_from_alpm(p)
+                break
+    return found
+
+
 def get_installed_packages():
     return pyalpm_handle.get_localdb().pkgcache
 
@@ -3,72 +3,266 @@
 
 """Checks dependencies resulting from linking of shared libraries."""
 
-from collections import defaultdict
-import re
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import functools
+import io
+import mmap
+from itertools import chain, groupby
+from operator import itemgetter
 import os
+import shutil
+import struct
 import subprocess
 from typing import Literal, TypeAlias
 
 import Namcap.package
 from Namcap.ruleclass import TarballRule
-from Namcap.util import is_elf
-from Namcap.rules.rpath import get_rpaths
-from Namcap.rules.runpath import get_runpaths
-
-from elftools.elf.elffile import ELFFile
-from elftools.elf.dynamic import DynamicSection
+from Namcap.util import ELF_HEADER_MIN_SIZE, read_elf_dynamic
 
 Architecture: TypeAlias = Literal["i686", "x86-64"]
 
+LDSO_CACHE = "/etc/ld.so.cache"
+
+# ld.so.cache layout, see glibc's sysdeps/generic/dl-cache.h
+_LDSO_OLD_MAGIC = b"ld.so-1.7.0\0"
+_LDSO_NEW_MAGIC = b"glibc-ld.so.cache1.1"
+_LDSO_HEADER_SIZE = 48
+# flags, key, value, osversion, hwcap
+_LDSO_ENTRY_FORMAT = "=iIIIQ"
+_LDSO_FLAG_TYPE_MASK = 0x00FF
+_LDSO_FLAG_ELF_LIBC6 = 0x0003
+_LDSO_FLAG_ARCH_MASK = 0xFF00
+_LDSO_FLAG_X8664 = 0x0300
+
 libcache: dict[Architecture, dict[str, str]] = {"i686": {}, "x86-64": {}}
+_libcache_filled = False
+_libcache_mtime: int | None = None
 
 _DependsMap: TypeAlias = dict[str, str]
 _LibMap: TypeAlias = dict[str, set[str]]
 _ProvidesMap: TypeAlias = dict[str, set[str]]
+# (provides, depends) as returned by scanlibs()
+_ScanResult: TypeAlias = tuple[list[tuple[str, str]], list[tuple[str, str, str]]]
+
+
+def _split_soname(libname):
+    """
+    Split a library name into its .so name and version
+
+    ('libfoo.so.1.2' => ('libfoo.so', '1.2'))
+    """
+    idx = libname.find(".so")
+    soname = libname if idx == -1 else libname[: idx + 3]
+    idx = libname.rfind(".so.")
+    soversion = libname if idx == -1 else libname[idx + 4 :]
+    return soname, soversion
 
 
-def scanlibs(fileobj, filename, custom_libs, liblist, libdepends, libprovides):
+def _is_version_suffix(suffix):
     """
-    Find shared libraries in a file-like binary object
+    Whether suffix is made of ".<digits>" groups, i.e. what is left of libgpm.so.1.19.0 after libgpm.so.1
 
-    If it depends on a library or provides one, store that library's path.
+    Sometimes packages don't include all so .so, .so.1, .so.1.13, .so.1.13.19 files,
+    they rely on ldconfig to create all the symlinks.
     """
+    if not suffix:
+        return True
+    return suffix[0] == "." and all(seg.isdecimal() for seg in suffix[1:].split("."))
 
-    if not is_elf(fileobj):
-        return {}
 
-    elffile = ELFFile(fileobj)
-    for section in elffile.iter_sections():
-        if not isinstance(section, DynamicSection):
+def _so_stem(path):
+    "Return the path up to and including its first '.so', or an empty string"
+    idx = path.find(".so")
+    return "" if idx == -1 else path[: idx + 3]
+
+
+def scanlibs(elfinfo, filename, custom_libs):
+    """
+    Find shared libraries in the dynamic entries of an ELF file, as returned by read_elf_dynamic()
+
+    Libraries named in custom_libs are found in the package through the file's rpaths and skipped.
+
+    Returns:
+      provides -- a list of (soname, filename) for the library the file provides
+      depends -- a list of (soname, library path, filename) for the libraries the file depends on
+    """
+    provides: list[tuple[str, str]] = []
+    depends: list[tuple[str, str, str]] = []
+
+    needed, provided, _, bitsize = elfinfo
+    match bitsize:
+        case 32:
+            architecture: Architecture = "i686"
+        case 64:
+            architecture = "x86-64"
+    cache = libcache[architecture]
+    suffix = "-" + str(bitsize)
+
+    # DT_SONAME means it provides a library
+    if provided is not None and os.path.dirname(filename) in ["usr/lib", "usr/lib32"]:
+        soname, soversion = _split_soname(provided)
+        provides.append((soname + "=" + soversion + suffix, filename))
+
+    # DT_NEEDED means shared library
+    for libname in needed:
+        if libname in custom_libs:
+            continue
+        soname, soversion = _split_soname(libname)
+        libpath = cache.get(libname)
+        if libpath is None:
+            # We didn't know about the library, so add it for fail later
+            libpath = libname
+        else:
+            libpath = os.path.abspath(libpath)[1:]
+        depends.append((soname + "=" + soversion + suffix, libpath, filename))
+
+    return provides, depends
+
+
+# Files which are never ELF files, skipped without reading them
+# (no numeric suffixes like man pages' ".1": they would match versioned libraries)
+_NON_ELF_SUFFIXES = (
+    ".png",
+    ".svg",
+    ".txt",
+    ".md",
+    ".desktop",
+    ".service",
+    ".gz",
+    ".xz",
+    ".zst",
+    ".json",
+    ".yaml",
+    ".html",
+)
+_NON_ELF_DIRS = (
+    "usr/share/doc/",
+    "usr/share/icons/",
+    "usr/share/info/",
+    "usr/share/locale/",
+    "usr/share/man/",
+)
+
+
+# ELF files up to this size are read whole and parsed in worker threads,
+# larger ones are parsed in place to only read the parts that are needed
+_MAX_BUFFERED_SIZE = 16 << 20
+# Bound on the file data waiting for worker threads
+_MAX_PENDING_SIZE = 64 << 20
+
+
+def _elf_members(tar, members):
+    """
+    Yield (member, data, elfinfo) for the ELF files of a tarball, read in archive order
+
+    data is the content of the file, or None for files larger than _MAX_BUFFERED_SIZE.
+    These are parsed right away and elfinfo holds the result of read_elf_dynamic().
+    """
+    for entry in members:
+        # Anything smaller than an ELF header cannot be linked
+        if not entry.isfile() or entry.size < ELF_HEADER_MIN_SIZE:
+            continue
+        if entry.name.endswith(_NON_ELF_SUFFIXES) or entry.name.startswith(_NON_ELF_DIRS):
             continue
-        for tag in section.iter_tags():
-            bitsize = elffile.elfclass
-            match bitsize:
-                case 32:
-                    architecture: Architecture = "i686"
-                case 64:
-                    architecture = "x86-64"
-            # DT_SONAME means it provides a library
-            if tag.entry.d_tag == "DT_SONAME" and os.path.dirname(filename) in ["usr/lib", "usr/lib32"]:
-                soname = re.sub(r"\.so.*", ".so", tag.soname)
-                soversion = re.sub(r"^.*\.so\.", "", tag.soname)
-                libprovides[soname + "=" + soversion + "-" + str(bitsize)].add(filename)
-            # DT_NEEDED means shared library
-            if tag.entry.d_tag != "DT_NEEDED":
+        if entry.issparse():
+            # Sparse files need tarfile to fill in the holes
+            f = tar.extractfile(entry)
+        else:
+            # Regular files are stored contiguously, read them without wrapping them in a file object
+            f = tar.fileobj
+            f.seek(entry.offset_data)
+        try:
+            magic = f.read(4)
+            if magic != b"\x7fELF":
                 continue
-            libname = tag.needed
-            soname = re.sub(r"\.so.*", ".so", libname)
-            soversion = re.sub(r"^.*\.so\.", "", libname)
-            if libname in custom_libs:
-                libpath = custom_libs[libname][1:]
+            if entry.size <= _MAX_BUFFERED_SIZE:
+                data, elfinfo = magic + f.read(entry.size - 4), None
+            else:
+                with tar.extractfile(entry) as elf:
+                    data, elfinfo = None, read_elf_dynamic(elf)
+        finally:
+            if f is not tar.fileobj:
+                f.close()
+        yield entry, data, elfinfo
+
+
+def _scan_elf(filename, data, elfinfo, so_by_dir):
+    """
+    Find the shared libraries an ELF file depends on or provides
+
+    Takes the (data, elfinfo) pair yielded by _elf_members().
+    Returns the result of scanlibs(), empty lists if the file cannot be parsed.
+    """
+    if data is not None:
+        elfinfo = read_elf_dynamic(io.BytesIO(data))
+    if elfinfo is None:
+        return [], []
+    # find anything that could be rpath related
+    rpath_files: set[str] = set()
+    origin = "/" + os.path.dirname(filename)
+    for rp in elfinfo[2]:
+        rpath_files.update(so_by_dir.get(os.path.normpath(rp.replace("$ORIGIN", origin)), ()))
+    return scanlibs(elfinfo, filename, rpath_files)
+
+
+def _group_pairs(pairs):
+    "Turn a list of (key, value) into a dictionary { key => set(values) }"
+    return {k: {v for _, v in group} for k, group in groupby(sorted(pairs), key=itemgetter(0))}
+
+
+def _realpath(path, realdirs):
+    """
+    os.path.realpath() resolving each parent directory only once
+
+    realdirs is a dictionary { directory => resolved directory } shared between calls.
+    """
+    dirname, basename = os.path.split(path)
+    realdir = realdirs.get(dirname)
+    if realdir is None:
+        realdir = realdirs[dirname] = os.path.realpath(dirname)
+    path = os.path.join(realdir, basename)
+    if os.path.islink(path):
+        return os.path.realpath(path)
+    return path
+
+
+def _localdb_mtime():
+    "Return the modification time of the local pacman database, None if it cannot be read"
+    try:
+        return os.stat(os.path.join(Namcap.package.pyalpm_handle.dbpath, "local")).st_mtime_ns
+    except OSError:
+        return None
+
+
+@functools.lru_cache(maxsize=1)
+def _installed_file_index(localdb_mtime):
+    """
+    Index the shared libraries of the installed packages
+
+    The index is rebuilt whenever localdb_mtime changes.
+
+    Returns:
+      files_by_stem -- a dictionary { .so stem => [files] }
+      owners -- a dictionary { file => [(package order, package)] }
+      pkg_provides -- a dictionary { package => set(provides) }
+    """
+    files_by_stem: dict[str, list[str]] = defaultdict(list)
+    owners: dict[str, list[tuple[int, str]]] = defaultdict(list)
+    pkg_provides: dict[str, set[str]] = {}
+
+    for order, pkg in enumerate(Namcap.package.get_installed_packages()):
+        pkg_provides[pkg.name] = set(pkg.provides)
+        for j, fsize, fmode in pkg.files:
+            # Whether we should even look at a particular file
+            stem = _so_stem(j)
+            if not stem:
                 continue
-            try:
-                libpath = os.path.abspath(libcache[architecture][libname])[1:]
-            except KeyError:
-                # We didn't know about the library, so add it for fail later
-                libpath = libname
-            libdepends[soname + "=" + soversion + "-" + str(bitsize)] = libpath
-            liblist[libpath].add(filename)
+            if j not in owners:
+                files_by_stem[stem].append(j)
+            owners[j].append((order, pkg.name))
+
+    return files_by_stem, owners, pkg_provides
 
 
 def finddepends(libdepends):
@@ -85,55 +279,150 @@ def finddepends(libdepends):
     libdependlist = {}
     missing_provides = {}
 
-    actualpath = {}
-
     knownlibs = set(libdepends)
     foundlibs = set()
 
-    actualpath = dict((j, os.path.realpath("/" + libdepends[j])[1:]) for j in knownlibs)
+    # Group the required libraries by their resolved path
+    path_index: dict[str, list[str]] = defaultdict(list)
+    realpaths: dict[str, str] = {}
+    realdirs: dict[str, str] = {}
+    for k in knownlibs:
+        lib = libdepends[k]
+        path = realpaths.get(lib)
+        if path is None:
+            path = realpaths[lib] = _realpath("/" + lib, realdirs)[1:]
+        path_index[path].append(k)
+
+    files_by_stem, owners, pkg_provides = _installed_file_index(_localdb_mtime())
+
+    matches: list[tuple[int, str, str]] = []
+    for path, libs in path_index.items():
+        stem = _so_stem(path)
+        # Paths without a ".so" stem could be a prefix of any file
+        candidates = files_by_stem.get(stem, ()) if stem else chain.from_iterable(files_by_stem.values())
+        for j in candidates:
+            # File must be an exact match or have the right .so ending numbers
+            # i.e. gpm includes libgpm.so and libgpm.so.1.19.0, but everything links to libgpm.so.1
+            # We compare find libgpm.so.1.19.0 startswith libgpm.so.1 and .19.0 is a version suffix
+            if j == path or (j.startswith(path) and _is_version_suffix(j[len(path) :])):
+                matches.extend((order, pkgname, k) for order, pkgname in owners[j] for k in libs)
+
+    # Apply the matches in installed packages order, so the last owner wins as it always did
+    for order, pkgname, k in sorted(matches):
+        dependlist[pkgname].add(libdepends[k])
+        foundlibs.add(k)
+        # Check if the dependency can be satisfied by soname
+        if k in pkg_provides[pkgname]:
+            libdependlist[k] = pkgname
+        else:
+            missing_provides[k] = pkgname
+
+    orphans = sorted(knownlibs - foundlibs)
+    return dependlist, libdependlist, orphans, missing_provides
 
-    # Sometimes packages don't include all so .so, .so.1, .so.1.13, .so.1.13.19 files
-    # They rely on ldconfig to create all the symlinks
-    # So we will strip off the matching part of the files and use this regexp to match the rest
-    so_end = re.compile(r"(\.\d+)*")
-    # Whether we should even look at a particular file
-    is_so = re.compile(r"\.so")
 
-    for pkg in Namcap.package.get_installed_packages():
-        for j, fsize, fmode in pkg.files:
-            if not is_so.search(j):
-                continue
+def _read_ldso_cache(path):
+    """
+    Read the entries of a glibc ld.so.cache file
 
-            for k in knownlibs:
-                # File must be an exact match or have the right .so ending numbers
-                # i.e. gpm includes libgpm.so and libgpm.so.1.19.0, but everything links to libgpm.so.1
-                # We compare find libgpm.so.1.19.0 startswith libgpm.so.1 and .19.0 matches the regexp
-                if j == actualpath[k] or (j.startswith(actualpath[k]) and so_end.match(j[len(actualpath[k]) :])):
-                    dependlist[pkg.name].add(libdepends[k])
-                    foundlibs.add(k)
-                    # Check if the dependency can be satisfied by soname
-                    if k in pkg.provides:
-                        libdependlist[k] = pkg.name
-                    else:
-                        missing_provides[k] = pkg.name
-
-    orphans = list(knownlibs - foundlibs)
-    return dependlist, libdependlist, orphans, missing_provides
+    Returns a list of (library name, flags, library path), None if the file cannot be read.
+    """
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as data:
+            start = 0
+            # Caches written by glibc < 2.32 start with entries in the old format, skip them
+            if data[: len(_LDSO_OLD_MAGIC)] == _LDSO_OLD_MAGIC:
+                (nlibs,) = struct.unpack_from("=I", data, len(_LDSO_OLD_MAGIC))
+                start = len(_LDSO_OLD_MAGIC) + 4 + nlibs * 12
+                start = (start + 7) & ~7
+            if data[start : start + len(_LDSO_NEW_MAGIC)] != _LDSO_NEW_MAGIC:
+                return None
+            (nlibs,) = struct.unpack_from("=I", data, start + len(_LDSO_NEW_MAGIC))
+
+            def string(offset):
+                offset += start
+                end = data.find(b"\0", offset)
+                if end == -1:
+                    raise ValueError("unterminated string in ld.so.cache")
+                return data[offset:end].decode("utf-8", "replace")
+
+            entries = []
+            for flags, key, value, _, _ in struct.iter_unpack(
+                _LDSO_ENTRY_FORMAT, data[start + _LDSO_HEADER_SIZE : start + _LDSO_HEADER_SIZE + nlibs * 24]
+            ):
+                entries.append((string(key), flags, string(value)))
+            return entries
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def _run_ldconfig():
+    "Return the output of ldconfig -p, empty if ldconfig cannot be run"
+    # ldconfig usually lives in a sbin directory, which is not always in $PATH
+    search_path = os.pathsep.join([os.environ.get("PATH", os.defpath), "/usr/sbin", "/sbin"])
+    ldconfig = shutil.which("ldconfig", path=search_path)
+    if ldconfig is None:
+        return ""
+    try:
+        return subprocess.run(
+            [ldconfig, "-p"],
+            env=dict(os.environ, LC_ALL="C"),
+            capture_output=True,
+            encoding="utf-8",
+            errors="replace",
+        ).stdout
+    except OSError:
+        return ""
 
 
 def filllibcache():
-    var = subprocess.Popen(
-        "ldconfig -p", env={"LANG": "C"}, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    ).communicate()
-    libline = re.compile(r"\s*(.*) \((.*)\) => (.*)")
-    for j in var[0].decode("ascii").splitlines():
-        g = libline.match(j)
-        if g is not None:
-            if g.group(2).startswith("libc6,x86-64"):
-                libcache["x86-64"][g.group(1)] = g.group(3)
+    """
+    Fill libcache from the ld.so cache
+
+    The cache is only refreshed when /etc/ld.so.cache changed since the last call.
+    """
+    global _libcache_filled, _libcache_mtime
+
+    try:
+        mtime: int | None = os.stat(LDSO_CACHE).st_mtime_ns
+    except OSError:
+        mtime = None
+    if _libcache_filled and mtime == _libcache_mtime:
+        return
+
+    for arch in libcache.values():
+        arch.clear()
+
+    entries = _read_ldso_cache(LDSO_CACHE)
+    if entries is not None:
+        for name, flags, path in entries:
+            if (
+                flags & _LDSO_FLAG_TYPE_MASK == _LDSO_FLAG_ELF_LIBC6
+                and flags & _LDSO_FLAG_ARCH_MASK == _LDSO_FLAG_X8664
+            ):
+                libcache["x86-64"][name] = path
+            else:
+                # TODO: This is bogus; what about non x86-architectures?
+                libcache["i686"][name] = path
+    else:
+        # Unknown cache format, let ldconfig read it
+        out = _run_ldconfig()
+        # Lines look like "\tlibfoo.so.1 (libc6,x86-64) => /usr/lib/libfoo.so.1"
+        for j in out.splitlines():
+            lib, sep, path = j.partition(" => ")
+            if not sep:
+                continue
+            name, sep, flags_str = lib.strip().rpartition(" (")
+            if not sep:
+                continue
+            if flags_str.startswith("libc6,x86-64"):
+                libcache["x86-64"][name] = path
             else:
                 # TODO: This is bogus; what do non x86-architectures print?
-                libcache["i686"][g.group(1)] = g.group(3)
+                libcache["i686"][name] = path
+
+    _libcache_filled = True
+    _libcache_mtime = mtime
 
 
 class SharedLibsRule(TarballRule):
@@ -141,52 +430,62 @@ class SharedLibsRule(TarballRule):
     description = "Checks dependencies caused by linked shared libraries"
 
     def analyze(self, pkginfo, tar):
-        liblist: _LibMap = defaultdict(set)
-        libdepends: _DependsMap = defaultdict(str)
-        libprovides: _ProvidesMap = defaultdict(set)
+        scans: list[_ScanResult] = []
         dependlist = {}
         libdependlist = {}
         missing_provides = {}
         filllibcache()
         os.environ["LC_ALL"] = "C"
-        pkg_so_files = ["/" + n for n in tar.getnames() if ".so" in n]
-
-        for entry in tar:
-            if not entry.isfile():
-                continue
-            f = tar.extractfile(entry)
-            # find anything that could be rpath related
-            rpath_files = {}
-            if is_elf(f):
-                rpaths = list(get_rpaths(f)) + list(get_runpaths(f))
-                f.seek(0)
-                for n in pkg_so_files:
-                    for rp in rpaths:
-                        rp = os.path.normpath(rp.replace("$ORIGIN", "/" + os.path.dirname(entry.path)))
-                        if os.path.dirname(n) == rp:
-                            rpath_files[os.path.basename(n)] = n
-            scanlibs(f, entry.name, rpath_files, liblist, libdepends, libprovides)
-            f.close()
+        members = tar.getmembers()
+        # Group the package's .so files by directory to resolve rpaths
+        so_by_dir: dict[str, list[str]] = defaultdict(list)
+        for m in members:
+            if ".so" in m.name:
+                n = "/" + m.name
+                so_by_dir[os.path.dirname(n)].append(os.path.basename(n))
+
+        # tarfile is not thread-safe: read the ELF files here and parse them in worker threads
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            pending: deque[tuple[int, Future[_ScanResult]]] = deque()
+            pending_size = 0
+            for entry, data, elfinfo in _elf_members(tar, members):
+                size = 0 if data is None else len(data)
+                pending.append((size, executor.submit(_scan_elf, entry.name, data, elfinfo, so_by_dir)))
+                pending_size += size
+                # Collect in submission order and bound the amount of file data held in memory
+                while pending and (pending[0][1].done() or pending_size > _MAX_PENDING_SIZE):
+                    size, future = pending.popleft()
+                    pending_size -= size
+                    scans.append(future.result())
+            scans.extend(future.result() for _, future in pending)
+
+        # Fold the collected pairs into maps, later files win for libdepends as they always did
+        provides_pairs = [pair for provides, _ in scans for pair in provides]
+        depends_pairs = [pair for _, depends in scans for pair in depends]
+        libdepends: _DependsMap = {soname: libpath for soname, libpath, _ in depends_pairs}
+        liblist: _LibMap = _group_pairs((libpath, filename) for _, libpath, filename in depends_pairs)
+        libprovides: _ProvidesMap = _group_pairs(provides_pairs)
 
         # Ldd all the files and find all the link and script dependencies
         dependlist, libdependlist, orphans, missing_provides = finddepends(libdepends)
 
         # Filter out internal dependencies
-        libdependlist = dict(filter(lambda elem: elem[1] != pkginfo["name"], libdependlist.items()))
-        missing_provides = dict(filter(lambda elem: elem[1] != pkginfo["name"], missing_provides.items()))
+        self_name = pkginfo["name"]
+        libdependlist = {k: v for k, v in libdependlist.items() if v != self_name}
+        missing_provides = {k: v for k, v in missing_provides.items() if v != self_name}
+
+        # Format the files needing each library once, sorted for a stable output
+        liblist_str = {libpath: str(sorted(files)) for libpath, files in liblist.items()}
 
         # Handle "no package associated" errors
         self.warnings.extend(
-            [
-                ("library-no-package-associated %s %s", (libdepends[i], str(list(liblist[libdepends[i]]))))
-                for i in orphans
-            ]
+            [("library-no-package-associated %s %s", (libdepends[i], liblist_str[libdepends[i]])) for i in orphans]
         )
 
         # Hanle when a required soname does not provided by the associated package yet
         self.infos.extend(
             [
-                ("libdepends-missing-provides %s %s (%s)", (i, missing_provides[i], str(list(liblist[libdepends[i]]))))
+                ("libdepends-missing-provides %s %s (%s)", (i, missing_provides[i], liblist_str[libdepends[i]]))
                 for i in missing_provides
             ]
         )
@@ -194,10 +493,10 @@ class SharedLibsRule(TarballRule):
         # Print link-level deps
         for pkg, libraries in dependlist.items():
             if isinstance(libraries, set):
-                files = list(libraries)
+                files = sorted(libraries)
                 needing = set().union(*[liblist[lib] for lib in libraries])
                 reasons = pkginfo.detected_deps.setdefault(pkg, [])
-                reasons.append(("libraries-needed %s %s", (str(files), str(list(needing)))))
+                reasons.append(("libraries-needed %s %s", (str(files), str(sorted(needing)))))
                 self.infos.append(("link-level-dependence %s in %s", (pkg, str(files))))
 
         # Check for soname dependencies
@@ -206,7 +505,7 @@ class SharedLibsRule(TarballRule):
                 self.infos.append(
                     (
                         "libdepends-detected-satisfied %s %s (%s)",
-                        (i, libdependlist[i], str(list(liblist[libdepends[i]]))),
+                        (i, libdependlist[i], liblist_str[libdepends[i]]),
                     )
                 )
                 continue
@@ -214,22 +513,29 @@ class SharedLibsRule(TarballRule):
                 self.infos.append(
                     (
                         "libdepends-detected-but-optional %s %s (%s)",
-                        (i, libdependlist[i], str(list(liblist[libdepends[i]]))),
+                        (i, libdependlist[i], liblist_str[libdepends[i]]),
                     )
                 )
                 continue
             self.infos.append(
                 (
                     "libdepends-detected-not-included %s %s (%s)",
-                    (i, libdependlist[i], str(list(liblist[libdepends[i]]))),
+                    (i, libdependlist[i], liblist_str[libdepends[i]]),
                 )
             )
 
-        for i in pkginfo["depends"]:
-            if ".so" in i and i not in libdependlist:
-                self.warnings.append(("libdepends-not-needed %s", (i,)))
-            if i.endswith(".so"):
-                self.errors.append(("libdepends-without-version %s", (i,)))
+        # Check sonames listed in depends and provides
+        for field, detected, unneeded, unversioned in (
+            ("depends", libdependlist, "libdepends-not-needed %s", "libdepends-without-version %s"),
+            ("provides", libprovides, "libprovides-missing %s", "libprovides-without-version %s"),
+        ):
+            for i in pkginfo[field]:
+                if ".so" not in i:
+                    continue
+                if i not in detected:
+                    self.warnings.append((unneeded, (i,)))
+                if i.endswith(".so"):
+                    self.errors.append((unversioned, (i,)))
 
         self.infos.append(
             (
@@ -241,21 +547,17 @@ class SharedLibsRule(TarballRule):
         # Check provided libraries
         for i in libprovides:
             if i in pkginfo["provides"]:
-                self.infos.append(("libprovides-satisfied %s %s", (i, str(list(libprovides[i])))))
+                self.infos.append(("libprovides-satisfied %s %s", (i, str(sorted(libprovides[i])))))
                 continue
-            self.infos.append(("libprovides-unsatisfied %s %s", (i, str(list(libprovides[i])))))
-
-        for i in pkginfo["provides"]:
-            if ".so" in i and i not in libprovides:
-                self.warnings.append(("libprovides-missing %s", (i,)))
-            if i.endswith(".so"):
-                self.errors.append(("libprovides-without-version %s", (i,)))
+            self.infos.append(("libprovides-unsatisfied %s %s", (i, str(sorted(libprovides[i])))))
 
         self.infos.append(("libprovides-by-namcap-sight provides=(%s)", (" ".join(libprovides),)))
 
         # Check for packages in testing
+        testing = {k: v for k, v in Namcap.package.load_many_testing(dependlist).items() if v is not None}
+        installed = Namcap.package.load_many_from_db(testing)
         for i in dependlist.keys():
-            p = Namcap.package.load_testing_package(i)
-            q = Namcap.package.load_from_db(i)
+            p = testing.get(i)
+            q = installed.get(i)
             if p is not None and q is not None and p["version"] == q["version"]:
                 self.warnings.append(("dependency-is-testing-release %s", (i,)))
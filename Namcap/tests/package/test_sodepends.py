@@ -1,8 +1,21 @@
 # Copyright (C) 2003-2023 Namcap contributors, see AUTHORS for details.
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import io
 import os
+import shutil
+import struct
+import subprocess
+import tarfile
+import tempfile
+import unittest
+from types import SimpleNamespace
+from typing import Any
+from unittest import mock
 from Namcap.tests.makepkg import MakepkgTest
+from Namcap.tests.test_util import make_elf
+from Namcap.util import read_elf_dynamic
+import Namcap.package
 import Namcap.rules.sodepends
 from elftools.elf.dynamic import DynamicSection
 from elftools.elf.elffile import ELFFile
@@ -18,6 +31,328 @@ def get_soname(filename):
                 return tag.soname
 
 
+def make_ldso_cache(entries, old_format=False):
+    """
+    Forge a glibc ld.so.cache from a list of (name, flags, path), in the new format only
+    or preceded by an old format section as written by glibc < 2.32
+    """
+    strings = b""
+    offsets = []
+    for name, flags, path in entries:
+        # string offsets are relative to the new format header
+        key = 48 + 24 * len(entries) + len(strings)
+        strings += name.encode() + b"\0"
+        value = 48 + 24 * len(entries) + len(strings)
+        strings += path.encode() + b"\0"
+        offsets.append((flags, key, value))
+
+    new = b"glibc-ld.so.cache1.1" + struct.pack("=IIB3xI3I", len(entries), len(strings), 2, 0, 0, 0, 0)
+    new += b"".join(struct.pack("=iIIIQ", flags, key, value, 0, 0) for flags, key, value in offsets)
+    new += strings
+    if not old_format:
+        return new
+
+    old = b"ld.so-1.7.0\0" + struct.pack("=I", len(entries))
+    old += b"".join(struct.pack("=iII", flags, 0, 0) for flags, _, _ in offsets)
+    # the new format section is aligned on 8 bytes
+    old += b"\0" * (-len(old) % 8)
+    return old + new
+
+
+class LdsoCacheTest(unittest.TestCase):
+    entries = [
+        ("libalpm.so.14", 0x0303, "/usr/lib/libalpm.so.14"),
+        ("libc.so.6", 0x0303, "/usr/lib/libc.so.6"),
+        ("libc.so.6", 0x0003, "/usr/lib32/libc.so.6"),
+    ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_cache(self, data):
+        path = os.path.join(self.tmpdir, "ld.so.cache")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_new_format(self):
+        path = self.write_cache(make_ldso_cache(self.entries))
+        self.assertEqual(Namcap.rules.sodepends._read_ldso_cache(path), self.entries)
+
+    def test_old_and_new_format(self):
+        # with 1 entry the new format section needs padding to be aligned on 8 bytes, with 2 it does not
+        for entries in (self.entries[:1], self.entries[:2]):
+            path = self.write_cache(make_ldso_cache(entries, old_format=True))
+            self.assertEqual(Namcap.rules.sodepends._read_ldso_cache(path), entries)
+
+    def test_invalid(self):
+        path = self.write_cache(b"garbage" * 10)
+        self.assertIsNone(Namcap.rules.sodepends._read_ldso_cache(path))
+        path = self.write_cache(make_ldso_cache(self.entries)[:100])
+        self.assertIsNone(Namcap.rules.sodepends._read_ldso_cache(path))
+        self.assertIsNone(Namcap.rules.sodepends._read_ldso_cache(os.path.join(self.tmpdir, "missing")))
+
+    def fill(self, path, **kwargs):
+        with (
+            mock.patch.object(Namcap.rules.sodepends, "LDSO_CACHE", path),
+            mock.patch.object(Namcap.rules.sodepends, "_libcache_filled", False),
+            mock.patch.object(Namcap.rules.sodepends, "libcache", {"i686": {}, "x86-64": {}}),
+            mock.patch("shutil.which", return_value="/usr/bin/ldconfig"),
+            mock.patch("subprocess.run", **kwargs) as run,
+        ):
+            Namcap.rules.sodepends.filllibcache()
+            return Namcap.rules.sodepends.libcache, run
+
+    def test_filllibcache(self):
+        libcache, run = self.fill(self.write_cache(make_ldso_cache(self.entries)))
+        run.assert_not_called()
+        self.assertEqual(
+            libcache,
+            {
+                "x86-64": {"libalpm.so.14": "/usr/lib/libalpm.so.14", "libc.so.6": "/usr/lib/libc.so.6"},
+                "i686": {"libc.so.6": "/usr/lib32/libc.so.6"},
+            },
+        )
+
+    def test_filllibcache_ldconfig_fallback(self):
+        output = (
+            "3 libs found in cache `/etc/ld.so.cache'\n"
+            "\tlibalpm.so.14 (libc6,x86-64) => /usr/lib/libalpm.so.14\n"
+            "\tlibc.so.6 (libc6,x86-64, OS ABI: Linux 4.4.0) => /usr/lib/libc.so.6\n"
+            "\tlibc.so.6 (libc6) => /usr/lib32/libc.so.6\n"
+        )
+        result = subprocess.CompletedProcess([], 0, stdout=output, stderr="")
+        libcache, run = self.fill(self.write_cache(b"garbage" * 10), return_value=result)
+        run.assert_called_once()
+        self.assertEqual(
+            libcache,
+            {
+                "x86-64": {"libalpm.so.14": "/usr/lib/libalpm.so.14", "libc.so.6": "/usr/lib/libc.so.6"},
+                "i686": {"libc.so.6": "/usr/lib32/libc.so.6"},
+            },
+        )
+
+    def test_filllibcache_without_ldconfig(self):
+        libcache, run = self.fill(self.write_cache(b"garbage" * 10), side_effect=FileNotFoundError("ldconfig"))
+        run.assert_called_once()
+        self.assertEqual(libcache, {"i686": {}, "x86-64": {}})
+
+
+class FindDependsTest(unittest.TestCase):
+    libdir = "usr/lib/__namcap_test_sodepends"
+
+    def setUp(self):
+        # the index of installed files is cached per process
+        Namcap.rules.sodepends._installed_file_index.cache_clear()
+        self.packages: list[SimpleNamespace] = []
+        patcher = mock.patch.object(Namcap.package, "get_installed_packages", lambda: self.packages)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        Namcap.rules.sodepends._installed_file_index.cache_clear()
+
+    def add_package(self, name, files, provides=()):
+        files = [(os.path.join(self.libdir, f), 0, 0o644) for f in files]
+        self.packages.append(SimpleNamespace(name=name, files=files, provides=list(provides)))
+
+    def finddepends(self, libdepends):
+        libdepends = {k: os.path.join(self.libdir, v) for k, v in libdepends.items()}
+        dependlist, libdependlist, orphans, missing_provides = Namcap.rules.sodepends.finddepends(libdepends)
+        return dict(dependlist), libdependlist, sorted(orphans), missing_provides
+
+    def test_provides(self):
+        self.add_package("gpm", ["libgpm.so.1"], provides=["libgpm.so=1-64"])
+        self.add_package("foo", ["libfoo.so.2"])
+        dependlist, libdependlist, orphans, missing_provides = self.finddepends(
+            {"libgpm.so=1-64": "libgpm.so.1", "libfoo.so=2-64": "libfoo.so.2", "libbar.so=3-64": "libbar.so.3"}
+        )
+        self.assertEqual(
+            dependlist,
+            {"gpm": {os.path.join(self.libdir, "libgpm.so.1")}, "foo": {os.path.join(self.libdir, "libfoo.so.2")}},
+        )
+        self.assertEqual(libdependlist, {"libgpm.so=1-64": "gpm"})
+        self.assertEqual(missing_provides, {"libfoo.so=2-64": "foo"})
+        self.assertEqual(orphans, ["libbar.so=3-64"])
+
+    def test_last_owner_wins(self):
+        self.add_package("gpm", ["libgpm.so.1"], provides=["libgpm.so=1-64"])
+        self.add_package("gpm-git", ["libgpm.so.1"], provides=["libgpm.so=1-64"])
+        self.add_package("gpm-bin", ["libgpm.so.1"])
+        dependlist, libdependlist, orphans, missing_provides = self.finddepends({"libgpm.so=1-64": "libgpm.so.1"})
+        self.assertEqual(set(dependlist), {"gpm", "gpm-git", "gpm-bin"})
+        self.assertEqual(libdependlist, {"libgpm.so=1-64": "gpm-git"})
+        self.assertEqual(missing_provides, {"libgpm.so=1-64": "gpm-bin"})
+        self.assertEqual(orphans, [])
+
+    def test_exact_match(self):
+        self.add_package("foo", ["libfoo.so", "libfoo.so.2"], provides=["libfoo.so=2-64"])
+        dependlist, libdependlist, orphans, missing_provides = self.finddepends({"libfoo.so=2-64": "libfoo.so.2"})
+        self.assertEqual(dependlist, {"foo": {os.path.join(self.libdir, "libfoo.so.2")}})
+        self.assertEqual(libdependlist, {"libfoo.so=2-64": "foo"})
+        self.assertEqual(orphans, [])
+
+    def test_version_suffix(self):
+        # only the fully versioned file is packaged, ldconfig creates libgpm.so.1
+        self.add_package("gpm", ["libgpm.so", "libgpm.so.1.19.0"], provides=["libgpm.so=1-64"])
+        # libfoo.so.10 is not a newer libfoo.so.1
+        self.add_package("foo", ["libfoo.so.10", "libfoo.so.1.2-debug", "libfoo.so.1x"], provides=["libfoo.so=1-64"])
+        dependlist, libdependlist, orphans, missing_provides = self.finddepends(
+            {"libgpm.so=1-64": "libgpm.so.1", "libfoo.so=1-64": "libfoo.so.1"}
+        )
+        self.assertEqual(dependlist, {"gpm": {os.path.join(self.libdir, "libgpm.so.1")}})
+        self.assertEqual(libdependlist, {"libgpm.so=1-64": "gpm"})
+        self.assertEqual(orphans, ["libfoo.so=1-64"])
+
+    def test_no_so_stem(self):
+        # files without a ".so" are not indexed, and cannot be satisfied by a versioned file
+        self.add_package("bar", ["libbar", "libbar.1", "libbar.so.2"])
+        dependlist, libdependlist, orphans, missing_provides = self.finddepends({"libbar": "libbar"})
+        self.assertEqual(dependlist, {})
+        self.assertEqual(orphans, ["libbar"])
+
+    def test_is_version_suffix(self):
+        for suffix in ["", ".1", ".19.0", ".1.2.3.4"]:
+            self.assertTrue(Namcap.rules.sodepends._is_version_suffix(suffix), suffix)
+        for suffix in ["0", "9.0", ".", ".1.", "..1", ".1a", ".so", "-1.2", ".1.2-debug"]:
+            self.assertFalse(Namcap.rules.sodepends._is_version_suffix(suffix), suffix)
+
+    def test_index_cache(self):
+        self.add_package("gpm", ["libgpm.so.1"], provides=["libgpm.so=1-64"])
+        self.assertEqual(self.finddepends({"libgpm.so=1-64": "libgpm.so.1"})[1], {"libgpm.so=1-64": "gpm"})
+        # the index is only rebuilt when the local database changes
+        self.packages[0].name = "gpm-git"
+        self.assertEqual(self.finddepends({"libgpm.so=1-64": "libgpm.so.1"})[1], {"libgpm.so=1-64": "gpm"})
+        Namcap.rules.sodepends._installed_file_index.cache_clear()
+        self.assertEqual(self.finddepends({"libgpm.so=1-64": "libgpm.so.1"})[1], {"libgpm.so=1-64": "gpm-git"})
+
+
+class RealpathTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_realpath(self):
+        real = os.path.join(self.tmpdir, "usr", "lib")
+        os.makedirs(os.path.join(real, "foo"))
+        open(os.path.join(real, "libfoo.so.1.2.3"), "w").close()
+        open(os.path.join(real, "foo", "libbar.so.2.0"), "w").close()
+        # symlinked parent directories
+        os.symlink("usr/lib", os.path.join(self.tmpdir, "lib"))
+        os.symlink(os.path.join(real, "foo"), os.path.join(self.tmpdir, "foo"))
+        # symlinked libraries, relative, absolute and chained
+        os.symlink("libfoo.so.1.2.3", os.path.join(real, "libfoo.so.1"))
+        os.symlink(os.path.join(real, "libfoo.so.1"), os.path.join(real, "libfoo.so"))
+        os.symlink("foo/libbar.so.2.0", os.path.join(real, "libbar.so.2"))
+        os.symlink("missing.so.3", os.path.join(real, "libdangling.so.3"))
+
+        realdirs: dict[str, str] = {}
+        for name in [
+            "lib/libfoo.so.1.2.3",
+            "lib/libfoo.so.1",
+            "lib/libfoo.so",
+            "lib/libbar.so.2",
+            "lib/libdangling.so.3",
+            "lib/libmissing.so.4",
+            "foo/libbar.so.2.0",
+            "lib/foo/../libfoo.so.1",
+            "missing/libfoo.so.1",
+        ]:
+            path = os.path.join(self.tmpdir, name)
+            self.assertEqual(Namcap.rules.sodepends._realpath(path, realdirs), os.path.realpath(path), name)
+
+
+class ElfMembersTest(unittest.TestCase):
+    files = {
+        "usr/bin/main": make_elf(64, needed=["libc.so.6", "libfoo.so.1"]).getvalue() + b"\0" * 4096,
+        "usr/lib/libfoo.so.1": make_elf(64, needed=["libc.so.6"], soname="libfoo.so.1").getvalue(),
+        "usr/lib32/libbar.so.2": make_elf(32, needed=["libc.so.6"], soname="libbar.so.2").getvalue(),
+        "usr/bin/script": b"#!/bin/sh\n" + b"echo hello\n" * 10,
+        "usr/share/pkg/icon.png": make_elf(64, needed=["libpng.so.16"]).getvalue(),
+        "usr/share/man/man1/main.1": make_elf(64, needed=["libman.so.1"]).getvalue(),
+        "usr/lib/tiny": b"\x7fELF",
+    }
+    elf_files = ["usr/bin/main", "usr/lib/libfoo.so.1", "usr/lib32/libbar.so.2"]
+
+    def setUp(self):
+        Namcap.rules.sodepends._installed_file_index.cache_clear()
+        patchers: list[Any] = [
+            mock.patch.object(Namcap.rules.sodepends, "filllibcache", lambda: None),
+            mock.patch.object(Namcap.rules.sodepends, "libcache", {"i686": {}, "x86-64": {}}),
+            mock.patch.object(Namcap.package, "get_installed_packages", lambda: []),
+            mock.patch.object(Namcap.package, "load_many_testing", lambda names: {}),
+            mock.patch.object(Namcap.package, "load_many_from_db", lambda names: {}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        Namcap.rules.sodepends._installed_file_index.cache_clear()
+
+    def open_tarball(self, compression):
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode="w:" + compression) as tar:
+            for name, content in self.files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        data.seek(0)
+        tar = tarfile.open(fileobj=data, mode="r")
+        self.addCleanup(tar.close)
+        return tar
+
+    def elf_members(self, tar):
+        "Names and parsed dynamic entries of what _elf_members() yields"
+        return [
+            (entry.name, elfinfo if data is None else read_elf_dynamic(io.BytesIO(data)))
+            for entry, data, elfinfo in Namcap.rules.sodepends._elf_members(tar, tar.getmembers())
+        ]
+
+    def analyze(self, tar):
+        pkginfo = Namcap.package.PacmanPackage(
+            {"name": "__namcap_test", "depends": [], "optdepends": [], "provides": []}
+        )
+        rule = Namcap.rules.sodepends.SharedLibsRule()
+        rule.analyze(pkginfo, tar)
+        return rule.errors, rule.warnings, rule.infos
+
+    def test_reading_paths(self):
+        expected_members = [(name, read_elf_dynamic(io.BytesIO(self.files[name]))) for name in self.elf_files]
+        for compression in ("", "gz"):
+            tar = self.open_tarball(compression)
+            self.assertEqual(self.elf_members(tar), expected_members)
+            expected = self.analyze(tar)
+            self.assertIn(
+                ("libprovides-by-namcap-sight provides=(%s)", ("libbar.so=2-32 libfoo.so=1-64",)), expected[2]
+            )
+            self.assertIn(
+                (
+                    "library-no-package-associated %s %s",
+                    ("libc.so.6", "['usr/bin/main', 'usr/lib/libfoo.so.1', 'usr/lib32/libbar.so.2']"),
+                ),
+                expected[1],
+            )
+
+            variants: dict[str, Any] = {
+                # sparse members are read through extractfile()
+                "sparse": mock.patch.object(tarfile.TarInfo, "issparse", lambda self: True),
+                # large files are parsed in place
+                "in place": mock.patch.object(Namcap.rules.sodepends, "_MAX_BUFFERED_SIZE", 0),
+                # wait for each file to be parsed before reading the next one
+                "back-pressure": mock.patch.object(Namcap.rules.sodepends, "_MAX_PENDING_SIZE", 1),
+            }
+            for variant, patcher in variants.items():
+                with self.subTest(compression=compression, variant=variant), patcher:
+                    self.assertEqual(self.elf_members(tar), expected_members)
+                    self.assertEqual(self.analyze(tar), expected)
+
+
 class SoDependsTest(MakepkgTest):
     pkgbuild = """
 pkgname=__namcap_test_sodepends
@@ -5,6 +5,8 @@ import os
 import unittest
 import tempfile
 import shutil
+from types import SimpleNamespace
+from unittest import mock
 
 import Namcap.package
 
@@ -75,3 +77,78 @@ class PkgbuildLoaderTests(unittest.TestCase):
     def test_provides(self):
         self.assertEqual(self.pkginfo["provides"], ["yourpackage"])
         self.assertEqual(self.pkginfo["orig_provides"], ["yourpackage=0.9"])
+
+
+def fake_alpm_package(name, version="1.0-1", provides=()):
+    return SimpleNamespace(
+        name=name,
+        version=version,
+        conflicts=[],
+        url="http://www.example.com/",
+        depends=[],
+        desc="A package",
+        files=[],
+        groups=[],
+        has_scriptlet=False,
+        size=0,
+        licenses=[],
+        optdepends=[],
+        packager="",
+        provides=list(provides),
+        replaces=[],
+        arch="x86_64",
+        backup=[],
+    )
+
+
+class FakeDb:
+    def __init__(self, name, packages):
+        self.name = name
+        self.pkgcache = packages
+
+    def get_pkg(self, name):
+        for pkg in self.pkgcache:
+            if pkg.name == name:
+                return pkg
+        return None
+
+
+class DbLoaderTests(unittest.TestCase):
+    def setUp(self):
+        localdb = FakeDb(
+            "local",
+            [
+                fake_alpm_package("glibc"),
+                fake_alpm_package("libfoo", provides=["libfoo.so=1-64", "foo-provider=2.0"]),
+                fake_alpm_package("libfoo-git", provides=["foo-provider"]),
+            ],
+        )
+        syncdbs = [
+            FakeDb("core", [fake_alpm_package("glibc", "2.0-1")]),
+            FakeDb("core-testing", [fake_alpm_package("libfoo", "3.0-1")]),
+            FakeDb("testing", [fake_alpm_package("glibc", "3.0-1")]),
+            FakeDb("multilib-testing", [fake_alpm_package("glibc", "4.0-1"), fake_alpm_package("lib32-foo")]),
+        ]
+        handle = SimpleNamespace(get_localdb=lambda: localdb, get_syncdbs=lambda: syncdbs)
+        patcher = mock.patch.object(Namcap.package, "pyalpm_handle", handle)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_load_many_from_db(self):
+        names = ["glibc", "libfoo.so=1-64", "foo-provider", "missing"]
+        loaded = Namcap.package.load_many_from_db(names)
+        self.assertEqual(list(loaded), names)
+        for name in names:
+            self.assertEqual(loaded[name], Namcap.package.load_from_db(name))
+        # a name only found as a provide resolves to the first provider, as in load_from_db
+        self.assertEqual(loaded["foo-provider"]["name"], "libfoo")
+        self.assertIsNone(loaded["missing"])
+
+    def test_load_many_testing(self):
+        names = ["glibc", "libfoo", "lib32-foo", "missing"]
+        loaded = Namcap.package.load_many_testing(names)
+        self.assertEqual(list(loaded), names)
+        for name in names:
+            self.assertEqual(loaded[name], Namcap.package.load_testing_package(name))
+        self.assertEqual(loaded["glibc"]["version"], "3.0-1")
+        self.assertIsNone(loaded["libfoo"])
@@ -0,0 +1,85 @@
+# Copyright (C) 2003-2023 Namcap contributors, see AUTHORS for details.
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import io
+import struct
+import unittest
+
+from Namcap.util import read_elf_dynamic
+
+
+def make_elf(bitsize, endian="<", needed=(), soname=None, rpath=None, runpath=None):
+    """
+    Forge a minimal ELF file with a single PT_LOAD segment mapped at 0x1000
+    and a PT_DYNAMIC segment pointing to the given DT_NEEDED/DT_SONAME/DT_RPATH/DT_RUNPATH entries.
+    """
+    if bitsize == 64:
+        ehdr_fmt, phdr_fmt, dyn_fmt = "HHIQQQIHHH", "IIQQQQQQ", "qQ"
+    else:
+        ehdr_fmt, phdr_fmt, dyn_fmt = "HHIIIIIHHH", "IIIIIIII", "iI"
+    ehdr_size = 16 + struct.calcsize(endian + ehdr_fmt)
+    phdr_size = struct.calcsize(endian + phdr_fmt)
+    dyn_size = struct.calcsize(endian + dyn_fmt)
+    base = 0x1000
+
+    strtab = b"\0"
+    offsets = {}
+    for name in list(needed) + [s for s in (soname, rpath, runpath) if s]:
+        offsets[name] = len(strtab)
+        strtab += name.encode() + b"\0"
+
+    dyn_entries = [(1, offsets[n]) for n in needed]
+    if soname:
+        dyn_entries.append((14, offsets[soname]))
+    if rpath:
+        dyn_entries.append((15, offsets[rpath]))
+    if runpath:
+        dyn_entries.append((29, offsets[runpath]))
+    dyn_entries.append((5, 0))  # DT_STRTAB, address patched below
+    dyn_entries.append((0, 0))
+
+    dyn_offset = ehdr_size + 2 * phdr_size
+    strtab_offset = dyn_offset + dyn_size * len(dyn_entries)
+    dyn_entries[-2] = (5, base + strtab_offset)
+    total = strtab_offset + len(strtab)
+
+    def phdr(p_type, offset, vaddr, size):
+        if bitsize == 64:
+            return struct.pack(endian + phdr_fmt, p_type, 0, offset, vaddr, vaddr, size, size, 0)
+        return struct.pack(endian + phdr_fmt, p_type, offset, vaddr, vaddr, size, size, 0, 0)
+
+    ident = b"\x7fELF" + bytes([bitsize // 32, 1 if endian == "<" else 2, 1]) + b"\0" * 9
+    data = ident + struct.pack(endian + ehdr_fmt, 3, 0, 1, 0, ehdr_size, 0, 0, ehdr_size, phdr_size, 2)
+    data += phdr(1, 0, base, total)
+    data += phdr(2, dyn_offset, base + dyn_offset, dyn_size * len(dyn_entries))
+    data += b"".join(struct.pack(endian + dyn_fmt, *e) for e in dyn_entries)
+    data += strtab
+    return io.BytesIO(data)
+
+
+class ReadElfDynamicTests(unittest.TestCase):
+    def test_elf64(self):
+        f = make_elf(64, needed=["libc.so.6", "libalpm.so.14"], soname="libfoo.so.1")
+        self.assertEqual(read_elf_dynamic(f), (["libc.so.6", "libalpm.so.14"], "libfoo.so.1", [], 64))
+        self.assertEqual(f.tell(), 0)
+
+    def test_elf32_big_endian(self):
+        f = make_elf(32, endian=">", needed=["libc.so.6"])
+        self.assertEqual(read_elf_dynamic(f), (["libc.so.6"], None, [], 32))
+
+    def test_rpaths(self):
+        f = make_elf(64, needed=["libc.so.6"], rpath="/opt/foo/lib:$ORIGIN", runpath="/usr/lib/foo")
+        self.assertEqual(read_elf_dynamic(f), (["libc.so.6"], None, ["/opt/foo/lib", "$ORIGIN", "/usr/lib/foo"], 64))
+
+    def test_not_elf(self):
+        self.assertIsNone(read_elf_dynamic(io.BytesIO(b"#!/bin/sh\necho hello\n")))
+
+    def test_truncated(self):
+        data = make_elf(64, needed=["libc.so.6"]).getvalue()
+        self.assertIsNone(read_elf_dynamic(io.BytesIO(data[:40])))
+
+    def test_bogus_offsets(self):
+        data = bytearray(make_elf(64, needed=["libc.so.6"]).getvalue())
+        # e_phoff
+        struct.pack_into("<Q", data, 32, 2**63 + 5)
+        self.assertIsNone(read_elf_dynamic(io.BytesIO(bytes(data))))
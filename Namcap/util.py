@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 import re
+import struct
 
 
 def _file_has_magic(fileobj, magic_bytes):
@@ -16,6 +17,126 @@ def is_elf(fileobj):
     return _file_has_magic(fileobj, b"\x7fELF")
 
 
+# Size of the smallest (32-bit) ELF header
+ELF_HEADER_MIN_SIZE = 52
+
+# ELF constants used by read_elf_dynamic()
+_PT_LOAD = 1
+_PT_DYNAMIC = 2
+_DT_NULL = 0
+_DT_NEEDED = 1
+_DT_STRTAB = 5
+_DT_SONAME = 14
+_DT_RPATH = 15
+_DT_RUNPATH = 29
+
+# (ELF header after e_ident, program header, dynamic entry) layouts per ELF class
+_ELF_LAYOUTS = {
+    1: ("HHIIIIIHHH", "IIIIIIII", "iI"),
+    2: ("HHIQQQIHHH", "IIQQQQQQ", "qQ"),
+}
+
+
+def _read_cstring(fileobj, offset):
+    fileobj.seek(offset)
+    data = b""
+    while True:
+        chunk = fileobj.read(64)
+        if not chunk:
+            break
+        end = chunk.find(b"\0")
+        if end != -1:
+            data += chunk[:end]
+            break
+        data += chunk
+    return data.decode("utf-8", "replace")
+
+
+def read_elf_dynamic(fileobj):
+    """
+    Take file object, read the dynamic segment of an ELF file.
+
+    Returns (needed, soname, rpaths, bitsize) where needed is the list of
+    DT_NEEDED entries, soname the DT_SONAME entry (or None) and rpaths the
+    DT_RPATH then DT_RUNPATH paths, or None if the file is not a valid ELF file.
+    """
+    try:
+        fileobj.seek(0)
+        ident = fileobj.read(16)
+        if len(ident) < 16 or ident[:4] != b"\x7fELF" or ident[4] not in _ELF_LAYOUTS or ident[5] not in (1, 2):
+            return None
+        bitsize = 32 * ident[4]
+        endian = "<" if ident[5] == 1 else ">"
+        ehdr_fmt, phdr_fmt, dyn_fmt = (endian + fmt for fmt in _ELF_LAYOUTS[ident[4]])
+
+        ehdr = struct.unpack(ehdr_fmt, fileobj.read(struct.calcsize(ehdr_fmt)))
+        e_phoff, e_phentsize, e_phnum = ehdr[4], ehdr[8], ehdr[9]
+
+        # Map out the loadable segments (needed to translate DT_STRTAB) and the dynamic segment
+        loads = []
+        dynamic = None
+        if e_phnum and e_phentsize < struct.calcsize(phdr_fmt):
+            return None
+        fileobj.seek(e_phoff)
+        phdrs = fileobj.read(e_phentsize * e_phnum)
+        for i in range(e_phnum):
+            phdr = struct.unpack_from(phdr_fmt, phdrs, i * e_phentsize)
+            if bitsize == 64:
+                p_type, _, p_offset, p_vaddr, _, p_filesz = phdr[:6]
+            else:
+                p_type, p_offset, p_vaddr, _, p_filesz = phdr[:5]
+            if p_type == _PT_LOAD:
+                loads.append((p_vaddr, p_offset, p_filesz))
+            elif p_type == _PT_DYNAMIC:
+                dynamic = (p_offset, p_filesz)
+        if dynamic is None:
+            return [], None, [], bitsize
+
+        fileobj.seek(dynamic[0])
+        data = fileobj.read(dynamic[1])
+        dyn_size = struct.calcsize(dyn_fmt)
+        strtab = None
+        needed_offsets = []
+        soname_offset = None
+        rpath_offsets = []
+        runpath_offsets = []
+        for d_tag, d_val in struct.iter_unpack(dyn_fmt, data[: len(data) - len(data) % dyn_size]):
+            if d_tag == _DT_NULL:
+                break
+            if d_tag == _DT_NEEDED:
+                needed_offsets.append(d_val)
+            elif d_tag == _DT_SONAME:
+                soname_offset = d_val
+            elif d_tag == _DT_RPATH:
+                rpath_offsets.append(d_val)
+            elif d_tag == _DT_RUNPATH:
+                runpath_offsets.append(d_val)
+            elif d_tag == _DT_STRTAB:
+                strtab = d_val
+        if strtab is None:
+            return [], None, [], bitsize
+
+        # DT_STRTAB holds a virtual address, find its position in the file
+        for p_vaddr, p_offset, p_filesz in loads:
+            if p_vaddr <= strtab < p_vaddr + p_filesz:
+                strtab += p_offset - p_vaddr
+                break
+
+        needed = [_read_cstring(fileobj, strtab + offset) for offset in needed_offsets]
+        soname = None if soname_offset is None else _read_cstring(fileobj, strtab + soname_offset)
+        rpaths = [
+            path
+            for offset in rpath_offsets + runpath_offsets
+            for path in _read_cstring(fileobj, strtab + offset).split(":")
+        ]
+    except (struct.error, OverflowError, ValueError):
+        # Truncated data or offsets pointing outside of the file
+        return None
+    finally:
+        fileobj.seek(0)
+    return needed, soname, rpaths, bitsize
+
+
 def is_static(fileobj):
     "Take file object, peek at the magic bytes to check if static lib."
     return _file_has_magic(fileobj, b"!<arch>\n")